@@ -0,0 +1,170 @@
+"""AI兔子 分析结果的 Schema、JSON 修复与校验（不依赖 Streamlit，便于单独测试）"""
+import json
+import math
+import re
+
+# 结果 Schema：用于模型原生结构化输出与本地校验（类型、取值范围）
+RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ai_detection": {
+            "type": "object",
+            "properties": {
+                "label": {"type": "string", "enum": ["AI特征", "疑似AI", "人工特征"]},
+                "score": {"type": "integer", "minimum": 0, "maximum": 100},
+                "reason": {"type": "string"}
+            },
+            "required": ["label", "score", "reason"]
+        },
+        "plagiarism_detection": {
+            "type": "object",
+            "properties": {
+                "percentage": {"type": "integer", "minimum": 0, "maximum": 100},
+                "reason": {"type": "string"},
+                "sources": {"type": "string"}
+            },
+            "required": ["percentage", "reason", "sources"]
+        }
+    },
+    "required": ["ai_detection", "plagiarism_detection"]
+}
+
+def _close_json_fragment(out, stack):
+    """按括号栈补全被截断的 JSON 片段"""
+    fragment = "".join(out).rstrip().rstrip(",")
+    return fragment + "".join("}" if c == "{" else "]" for c in reversed(stack))
+
+def load_json_tolerant(text):
+    """宽容解析模型返回的 JSON，返回 (数据, 是否经过修复)"""
+    if not text:
+        return None, False
+    cleaned = re.sub(r'^\s*```(?:json)?|```\s*$', '', text).strip()
+    try:
+        data = json.loads(cleaned)
+        if isinstance(data, dict):
+            return data, False
+    except ValueError:
+        pass
+
+    start = cleaned.find("{")
+    if start == -1:
+        return None, False
+
+    # 逐字符扫描（区分字符串内外）：丢弃多余逗号，记录括号栈以及每个逗号处可安全截断的位置
+    out, stack, cuts = [], [], []
+    in_string = escape = complete = False
+    for ch in cleaned[start:]:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            out.append(ch)
+            continue
+        if ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        elif ch == ",":
+            cuts.append((len(out), list(stack)))
+        out.append(ch)
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                complete = True
+                break
+
+    candidates = []
+    if complete:
+        candidates.append("".join(out))
+    elif not in_string and "".join(out).rstrip()[-1:] in ('"', "}", "]", ","):
+        # 片段停在完整值之后才直接补括号；停在数字、字面量或字符串中间时，
+        # 这个成员可能不完整（如 85 被截成 8），只能退回到上一个逗号
+        candidates.append(_close_json_fragment(out, stack))
+    candidates += [_close_json_fragment(out[:pos], s) for pos, s in reversed(cuts)]
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate, strict=False)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data, True
+    if not complete:
+        # 在第一个逗号之前就被截断，没有可保留的成员：当作空对象，所有字段走补全
+        return {}, True
+    return None, False
+
+def _label_from_score(score):
+    """按 Prompt 中的分类标准由 AI 疑似度推出标签"""
+    return "AI特征" if score >= 80 else "疑似AI" if score >= 40 else "人工特征"
+
+def _coerce_field(value, spec):
+    """按 Schema 校验并规整单个字段，无效时返回 None"""
+    if spec["type"] == "integer":
+        if isinstance(value, str):
+            match = re.search(r'-?\d+(?:\.\d+)?', value)
+            value = float(match.group()) if match else None
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return None
+        # 不做截断或四舍五入：150、0.85（0-1 量纲）这类值视为无效，交给缺失字段补全
+        if value != int(value) or not spec.get("minimum", value) <= value <= spec.get("maximum", value):
+            return None
+        return int(value)
+    if isinstance(value, list):
+        value = "；".join(str(v) for v in value if v)
+    if not isinstance(value, str) or not value.strip():
+        return None
+    if "enum" in spec and value.strip() not in spec["enum"]:
+        return None
+    return value.strip()
+
+def validate_analysis_result(data):
+    """按 RESULT_SCHEMA 校验结果，返回 (规整后的结果, 缺失或无效的字段列表)"""
+    result, missing = {}, []
+    for section, section_spec in RESULT_SCHEMA["properties"].items():
+        raw = data.get(section) if isinstance(data, dict) else None
+        raw = raw if isinstance(raw, dict) else {}
+        cleaned = {}
+        for field, spec in section_spec["properties"].items():
+            value = _coerce_field(raw.get(field), spec)
+            if value is not None:
+                cleaned[field] = value
+        if section == "ai_detection" and "label" not in cleaned and "score" in cleaned:
+            cleaned["label"] = _label_from_score(cleaned["score"])
+        missing += [f"{section}.{field}" for field in section_spec["required"] if field not in cleaned]
+        result[section] = cleaned
+    return result, missing
+
+def merge_missing_fields(base, patch, missing):
+    """只把补全请求中属于缺失字段的部分合并进已有结果，已校验的字段不会被覆盖"""
+    merged = {section: dict(fields) for section, fields in base.items()}
+    for path in missing:
+        section, field = path.split(".", 1)
+        fields = (patch or {}).get(section)
+        if isinstance(fields, dict) and field in fields:
+            merged.setdefault(section, {})[field] = fields[field]
+    return merged
+
+# 不需要原文即可补全的字段：模型可根据上一轮回答给出；分数类字段必须重新阅读原文/图片
+FIELDS_WITHOUT_SOURCE = {"label", "reason", "sources"}
+
+def needs_source_content(missing):
+    """缺失字段中是否有必须重新发送原文/图片才能补全的字段"""
+    return any(path.split(".", 1)[1] not in FIELDS_WITHOUT_SOURCE for path in missing)
+
+def gemini_response_schema(schema):
+    """Gemini 的 response_schema 只支持 OpenAPI 子集，去掉 enum/取值范围（由本地校验保证）"""
+    converted = {"type": schema["type"]}
+    if "properties" in schema:
+        converted["properties"] = {k: gemini_response_schema(v) for k, v in schema["properties"].items()}
+    if "required" in schema:
+        converted["required"] = list(schema["required"])
+    return converted
@@ -0,0 +1,550 @@
+"""AI兔子 并发压测工具
+
+用 streamlit.testing 的 AppTest 在同一进程内模拟 N 个并发会话，驱动真实的 streamlit_app.py：
+文本/文档/图片提交、示例按钮点击和空闲重跑混合进行；analyze_with_zhipu / analyze_with_gemini
+背后的 SDK 被替换为本地可配置延迟的桩。输出每个并发级别的吞吐、延迟分位数、SQLite 等待
+和进程常驻内存，作为设置自动扩容阈值的容量曲线；每会话常驻内存用 tracemalloc 单独测量。
+
+只度量脚本执行本身（含模型等待、解析、统计写库），不包含 Tornado/WebSocket 的序列化开销。
+
+用法：
+    python loadtest.py --sessions 1,2,4,8,16 --actions 10 --latency-ms 1500 --csv capacity.csv
+"""
+import argparse
+import csv
+import gc
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+UPLOAD_STATE_KEY = "_loadtest_upload"
+GEMINI_OPTION = "Google Gemini (进阶)"
+
+# 各类操作的默认权重
+ACTION_WEIGHTS = {"text": 3, "document": 2, "image": 1, "sample": 2, "idle": 2}
+
+STUB_RESULT = {
+    "ai_detection": {"label": "疑似AI", "score": 62, "reason": "压测桩返回：句式较为工整，连接词使用偏多。"},
+    "plagiarism_detection": {"percentage": 8, "reason": "压测桩返回：未发现明显雷同。", "sources": "未在训练数据中发现明显匹配源"}
+}
+
+TEXT_SNIPPETS = [
+    "欢乐海岸非常好玩，因为不仅有好玩的还有好吃的。一到周末那里就人山人海。" * 5,
+    "人工智能技术的快速发展为各行各业带来了深刻变革。首先，它提高了生产效率；其次，它优化了资源配置；最后，它推动了创新。" * 8,
+    "The quick brown fox jumps over the lazy dog. " * 40,
+]
+
+# 压测过程中共享的配置与统计（由 main 初始化）
+PROVIDER_CONFIG = {"latency_ms": 1500.0, "jitter_ms": 300.0, "malformed_rate": 0.0}
+LEVEL_STATS = {}  # 当前并发级别的统计，每轮开始时重置
+STATS_LOCK = threading.Lock()
+
+
+# -------------------------------------------------------------
+# 1. 本地模型桩（替换 zhipuai / google.generativeai）
+# -------------------------------------------------------------
+def _stub_response_text(last_message):
+    """按配置的延迟等待后返回结果。
+    缺失字段补全请求（FIELD_RETRY_PROMPT）只返回被点名的字段；
+    完整分析请求按比例在随机位置截断，以覆盖本地修复与补全路径"""
+    delay = random.gauss(PROVIDER_CONFIG["latency_ms"], PROVIDER_CONFIG["jitter_ms"])
+    time.sleep(max(0.0, delay) / 1000)
+
+    requested = re.findall(r'(ai_detection|plagiarism_detection)\.(\w+)', str(last_message))
+    if requested:
+        patch = defaultdict(dict)
+        for section, field in requested:
+            patch[section][field] = STUB_RESULT[section][field]
+        return json.dumps(patch, ensure_ascii=False)
+
+    text = json.dumps(STUB_RESULT, ensure_ascii=False)
+    if random.random() < PROVIDER_CONFIG["malformed_rate"]:
+        text = text[:random.randint(len(text) // 3, len(text) - 1)]
+    return text
+
+def install_provider_stubs():
+    """在应用导入前注册假的 SDK 模块，应用代码本身不做任何改动"""
+    zhipuai = types.ModuleType("zhipuai")
+
+    class ZhipuAI:
+        def __init__(self, api_key=None, **kwargs):
+            completions = types.SimpleNamespace(create=self._create)
+            self.chat = types.SimpleNamespace(completions=completions)
+
+        def _create(self, model, messages, **kwargs):
+            message = types.SimpleNamespace(content=_stub_response_text(messages[-1]["content"]))
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    zhipuai.ZhipuAI = ZhipuAI
+
+    genai = types.ModuleType("google.generativeai")
+
+    class GenerativeModel:
+        def __init__(self, model_name=None, system_instruction=None, generation_config=None, **kwargs):
+            pass
+
+        def generate_content(self, contents, generation_config=None, **kwargs):
+            return types.SimpleNamespace(text=_stub_response_text(contents[-1]))
+
+    genai.configure = lambda api_key=None, **kwargs: None
+    genai.GenerativeModel = GenerativeModel
+
+    import google  # 保留真实的 google 命名空间包（protobuf 依赖它）
+    sys.modules["zhipuai"] = zhipuai
+    sys.modules["google.generativeai"] = genai
+    google.generativeai = genai
+
+
+# -------------------------------------------------------------
+# 2. 运行环境补丁：上传、SQLite 计时、共享 Runtime
+# -------------------------------------------------------------
+class _StubUpload(io.BytesIO):
+    """模拟 st.file_uploader 返回的 UploadedFile"""
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+def patch_file_uploader(st):
+    """AppTest 不支持（旧版本）上传控件，这里改为从会话状态读取待上传文件"""
+    def file_uploader(label, type=None, *args, **kwargs):
+        pending = st.session_state.get(UPLOAD_STATE_KEY)
+        if pending and type and pending[0].rsplit(".", 1)[-1] in type:
+            return _StubUpload(*pending)
+        return None
+
+    st.file_uploader = file_uploader
+
+def patch_sqlite():
+    """为应用打开的每个连接计时，语句耗时中包含等待写锁的时间"""
+    real_connect = sqlite3.connect
+
+    def record(started, error=None):
+        elapsed = (time.perf_counter() - started) * 1000
+        with STATS_LOCK:
+            LEVEL_STATS["sqlite_ms"].append(elapsed)
+            if error is not None and "locked" in str(error):
+                LEVEL_STATS["sqlite_locked"] += 1
+
+    class TimedCursor(sqlite3.Cursor):
+        def execute(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = super().execute(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                record(started, e)
+                raise
+            record(started)
+            return result
+
+    class TimedConnection(sqlite3.Connection):
+        def cursor(self, factory=TimedCursor):
+            return super().cursor(factory)
+
+        def commit(self):
+            started = time.perf_counter()
+            try:
+                super().commit()
+            except sqlite3.OperationalError as e:
+                record(started, e)
+                raise
+            record(started)
+
+    def connect(*args, **kwargs):
+        kwargs.setdefault("factory", TimedConnection)
+        return real_connect(*args, **kwargs)
+
+    sqlite3.connect = connect
+
+def make_app_test_concurrent():
+    """AppTest 每次运行都会临时改写全局状态，多线程并发时会互相打断：
+    - 运行结束把全局 Runtime 实例置空：这里让置空失效，始终保留最近一次的模拟 Runtime；
+    - 运行期间临时打开 global.appTest 配置：这里改为整个进程常开，并去掉逐次补丁；
+    - 每次运行新建 ScriptCache 并发编译脚本（CPython 3.11 的 compile 并非线程安全）：
+      这里与真实服务一样共享同一个带锁的缓存"""
+    from contextlib import nullcontext
+    from streamlit import config
+    from streamlit.logger import set_log_level
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    config.set_option("logger.level", "error")
+    set_log_level("error")
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda overrides: nullcontext()
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    class _KeepInstance(type(Runtime)):
+        def __setattr__(cls, name, value):
+            if name != "_instance":
+                super().__setattr__(name, value)
+            elif value is not None:
+                Runtime._instance = value
+
+    app_test.Runtime = _KeepInstance("Runtime", (Runtime,), {})
+
+
+# -------------------------------------------------------------
+# 3. 测试素材
+# -------------------------------------------------------------
+def make_pdf(page_texts):
+    """生成一个只含 Helvetica 文本的最小 PDF"""
+    page_ids = [4 + 2 * i for i in range(len(page_texts))]
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for pid, text in zip(page_ids, page_texts):
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = f"BT /F1 10 Tf 40 800 Td ({escaped}) Tj ET".encode("latin-1")
+        objects[pid] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                        f"/Resources << /Font << /F1 3 0 R >> >> /Contents {pid + 1} 0 R >>").encode()
+        objects[pid + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for oid in sorted(objects):
+        offsets[oid] = len(out)
+        out += b"%d 0 obj\n" % oid + objects[oid] + b"\nendobj\n"
+    xref = len(out)
+    size = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for oid in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[oid]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    return bytes(out)
+
+def make_docx(paragraphs):
+    from docx import Document
+    doc = Document()
+    for para in paragraphs:
+        doc.add_paragraph(para)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def make_image():
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (800, 400), "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(10):
+        draw.text((20, 20 + i * 36), "The quick brown fox jumps over the lazy dog.", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _random_paragraphs(rng, total_chars, chars_per_paragraph=2000):
+    """随机字母文本，压缩率低，用于生成体积可控的文档"""
+    alphabet = "abcdefghijklmnopqrstuvwxyz "
+    count = max(1, total_chars // chars_per_paragraph)
+    return ["".join(rng.choices(alphabet, k=chars_per_paragraph)) for _ in range(count)]
+
+def build_fixtures(doc_pages, large_doc_mb=0):
+    """小文档之外，可选生成指定大小的大文档，覆盖解析内存预算（reserve_parse_memory）与截断路径"""
+    page_text = "Artificial intelligence is transforming how we write and read. " * 30
+    documents = [
+        ("loadtest.pdf", make_pdf([page_text] * doc_pages)),
+        ("loadtest.docx", make_docx([page_text] * doc_pages)),
+    ]
+    if large_doc_mb > 0:
+        rng = random.Random(0)
+        target = int(large_doc_mb * 1024 * 1024)
+        # PDF 内容不压缩；docx 是 zip，随机字母约压缩到 60%，多生成一些
+        documents.append(("loadtest_large.pdf", make_pdf(_random_paragraphs(rng, target))))
+        documents.append(("loadtest_large.docx", make_docx(_random_paragraphs(rng, int(target / 0.55)))))
+    return {"documents": documents, "image": ("loadtest.png", make_image())}
+
+
+# -------------------------------------------------------------
+# 4. 会话模拟
+# -------------------------------------------------------------
+def _record_error(stats, action, error):
+    with STATS_LOCK:
+        stats["errors"][f"{action}: {error}"] += 1
+
+def _timed_run(at, action, stats):
+    """执行一次重跑并记录耗时与异常"""
+    started = time.perf_counter()
+    error = None
+    try:
+        at.run()
+        if len(at.exception):
+            error = at.exception[0].message.splitlines()[0]
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = (time.perf_counter() - started) * 1000
+    with STATS_LOCK:
+        stats["latency_ms"][action].append(elapsed)
+    if error:
+        _record_error(stats, action, error)
+    return error is None
+
+def _timed_analysis(at, action, stats):
+    """执行一次提交分析的重跑，页面渲染出检测结果才算成功"""
+    if not _timed_run(at, action, stats):
+        return
+    if any("AI生成检测" in md.value for md in at.markdown):
+        with STATS_LOCK:
+            stats["analyses"] += 1
+    else:
+        shown = at.error[0].value if len(at.error) else "无错误提示"
+        _record_error(stats, action, f"未渲染检测结果（{shown}）")
+
+def _submit_upload(at, stats, fixture, button_key, action):
+    """先模拟上传触发的重跑，再点击分析按钮"""
+    at.session_state[UPLOAD_STATE_KEY] = fixture
+    try:
+        if _timed_run(at, "upload", stats):
+            at.button(key=button_key).click()
+            _timed_analysis(at, action, stats)
+    finally:
+        at.session_state[UPLOAD_STATE_KEY] = None
+
+def _perform(at, action, rng, fixtures, stats):
+    if action == "text":
+        at.text_area(key="text_input").input(rng.choice(TEXT_SNIPPETS))
+        at.button(key="btn_text").click()
+        _timed_analysis(at, action, stats)
+    elif action == "document":
+        _submit_upload(at, stats, rng.choice(fixtures["documents"]), "btn_doc", action)
+    elif action == "image":
+        _submit_upload(at, stats, fixtures["image"], "btn_img", action)
+    elif action == "sample":
+        at.button(key=f"btn_{rng.randrange(4)}").click()
+        _timed_run(at, action, stats)
+    else:
+        _timed_run(at, action, stats)
+
+def run_session(index, args, fixtures, stats):
+    """单个会话：首次加载后按权重随机执行若干操作，返回 AppTest 以便统计常驻内存"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed * 100003 + index)
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    _timed_run(at, "load", stats)
+    actions, weights = zip(*ACTION_WEIGHTS.items())
+    plan = ["gemini"] if rng.random() < args.gemini_ratio else []
+    plan += rng.choices(actions, weights, k=args.actions)
+
+    for action in plan:
+        try:
+            if action == "gemini":
+                # 切换模型只改控件值，随下一次操作一起重跑
+                at.radio(key="model_selector").set_value(GEMINI_OPTION)
+                continue
+            time.sleep(rng.uniform(0, args.think_ms) / 1000)
+            _perform(at, action, rng, fixtures, stats)
+        except Exception as e:
+            # 上一次重跑失败时控件可能不存在，记为错误后继续
+            _record_error(stats, action, f"{type(e).__name__}: {e}")
+    return at
+
+
+# -------------------------------------------------------------
+# 5. 统计与报告
+# -------------------------------------------------------------
+def _current_rss_mb():
+    """当前进程常驻内存（MB），非 Linux 平台退化为历史峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values, p):
+    """最近秩法分位数，空列表返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+def _reset_level_stats():
+    LEVEL_STATS.clear()
+    LEVEL_STATS.update(latency_ms=defaultdict(list), errors=Counter(), analyses=0, sqlite_ms=[], sqlite_locked=0)
+    return LEVEL_STATS
+
+def warm_up(args, fixtures):
+    """丢弃结果的预热会话：把导入、脚本编译、解析库加载等一次性开销挪出第一个并发级别"""
+    from streamlit.testing.v1 import AppTest
+
+    stats = _reset_level_stats()
+    rng = random.Random(args.seed)
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    _timed_run(at, "load", stats)
+    try:
+        for fixture in fixtures["documents"]:
+            _submit_upload(at, stats, fixture, "btn_doc", "document")
+        for action in ("text", "image", "sample", "idle"):
+            _perform(at, action, rng, fixtures, stats)
+        at.radio(key="model_selector").set_value(GEMINI_OPTION)
+        _perform(at, "text", rng, fixtures, stats)
+    except Exception as e:
+        _record_error(stats, "warmup", f"{type(e).__name__}: {e}")
+    for message, count in stats["errors"].most_common(3):
+        print(f"    预热出错 x{count} {message}")
+
+def measure_session_memory(args, fixtures):
+    """不计时的单独一轮：依次运行若干会话并保持存活，用 tracemalloc 统计每个会话常驻的 Python 内存（MB）。
+
+    进程 RSS 受分配器缓存和线程栈影响，并发前后相减可能为负，因此不用于每会话估算；
+    tracemalloc 只覆盖 Python 分配器，Pillow 图像缓冲等 C 库内存不计入。返回 None 表示无法得到正值。
+    """
+    if args.memory_sessions <= 0:
+        return None
+    stats = _reset_level_stats()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        apps = [run_session(i, args, fixtures, stats) for i in range(args.memory_sessions)]
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+        del apps
+    finally:
+        tracemalloc.stop()
+    for message, count in stats["errors"].most_common(3):
+        print(f"    内存测量出错 x{count} {message}")
+    per_session = retained / args.memory_sessions / 1024 / 1024
+    return round(per_session, 2) if per_session > 0 else None
+
+def run_level(sessions, args, fixtures):
+    """以给定并发数运行一轮，返回该级别的汇总指标"""
+    stats = _reset_level_stats()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        apps = list(pool.map(lambda i: run_session(i, args, fixtures, stats), range(sessions)))
+    wall = time.perf_counter() - started
+    gc.collect()
+    rss = _current_rss_mb()
+    del apps
+
+    all_latency = [v for values in stats["latency_ms"].values() for v in values]
+    analysis_latency = [v for key in ("text", "document", "image") for v in stats["latency_ms"][key]]
+    return {
+        "sessions": sessions,
+        "runs": len(all_latency),
+        "runs_per_s": round(len(all_latency) / wall, 2),
+        "analyses_per_s": round(stats["analyses"] / wall, 2),
+        "p50_ms": round(percentile(all_latency, 50)),
+        "p95_ms": round(percentile(all_latency, 95)),
+        "p99_ms": round(percentile(all_latency, 99)),
+        "analysis_p95_ms": round(percentile(analysis_latency, 95)),
+        "sqlite_p95_ms": round(percentile(stats["sqlite_ms"], 95), 2),
+        "sqlite_max_ms": round(max(stats["sqlite_ms"], default=0), 2),
+        "sqlite_locked": stats["sqlite_locked"],
+        "errors": sum(stats["errors"].values()),
+        "process_rss_mb": round(rss, 1),
+        "error_samples": stats["errors"].most_common(3),
+    }
+
+def print_report(rows, slo_ms, session_mb=None):
+    columns = [c for c in rows[0] if c != "error_samples"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).rjust(widths[c]) for c in columns))
+        for message, count in row["error_samples"]:
+            print(f"    x{count} {message}")
+
+    print(f"\n每会话常驻 Python 内存（tracemalloc）: {session_mb if session_mb is not None else '-'} MB")
+    healthy = [r["sessions"] for r in rows if r["errors"] == 0 and r["analysis_p95_ms"] <= slo_ms]
+    if healthy:
+        print(f"满足 SLO（分析 p95 <= {slo_ms} ms 且无错误）的最大并发会话数: {max(healthy)}")
+    else:
+        print(f"没有任何并发级别满足 SLO（分析 p95 <= {slo_ms} ms 且无错误）")
+
+
+# -------------------------------------------------------------
+# 6. 入口
+# -------------------------------------------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI兔子 并发会话压测（AppTest + 本地模型桩）")
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="逗号分隔的并发会话数，依次运行形成容量曲线")
+    parser.add_argument("--actions", type=int, default=10, help="每个会话在首次加载后执行的操作数")
+    parser.add_argument("--think-ms", type=float, default=500, help="操作间的随机思考时间上限（毫秒）")
+    parser.add_argument("--latency-ms", type=float, default=1500, help="模型桩的平均响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=300, help="模型桩延迟的标准差（毫秒）")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="模型桩返回截断 JSON 的比例")
+    parser.add_argument("--gemini-ratio", type=float, default=0.3, help="切换到 Gemini 的会话比例")
+    parser.add_argument("--doc-pages", type=int, default=20, help="测试文档的页数/段落数")
+    parser.add_argument("--large-doc-mb", type=float, default=0,
+                        help="额外加入该大小（MB）的 PDF/Word 文档，覆盖解析内存预算与截断路径")
+    parser.add_argument("--memory-sessions", type=int, default=4,
+                        help="单独测量每会话常驻内存时依次保持存活的会话数（0 表示跳过）")
+    parser.add_argument("--timeout", type=float, default=120, help="单次重跑的超时时间（秒）")
+    parser.add_argument("--slo-ms", type=float, default=5000, help="分析请求 p95 延迟目标（毫秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="运行目录（统计数据库与 secrets 存放处），默认使用临时目录并在结束后删除")
+    parser.add_argument("--csv", help="把容量曲线写入 CSV 文件")
+    return parser.parse_args(argv)
+
+def run_capacity_curve(args):
+    import streamlit as st
+    install_provider_stubs()
+    make_app_test_concurrent()
+    patch_file_uploader(st)
+    patch_sqlite()
+
+    fixtures = build_fixtures(args.doc_pages, args.large_doc_mb)
+    print("预热...", flush=True)
+    warm_up(args, fixtures)
+    print("测量每会话常驻内存...", flush=True)
+    session_mb = measure_session_memory(args, fixtures)
+    rows = []
+    for sessions in (int(s) for s in args.sessions.split(",") if s.strip()):
+        print(f"运行 {sessions} 个并发会话...", flush=True)
+        rows.append(run_level(sessions, args, fixtures))
+    return rows, session_mb
+
+def main(argv=None):
+    args = parse_args(argv)
+    PROVIDER_CONFIG.update(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           malformed_rate=args.malformed_rate)
+    csv_path = os.path.abspath(args.csv) if args.csv else None
+
+    # 在独立目录运行：统计数据库不污染线上数据，secrets 指向桩
+    workdir = args.workdir or tempfile.mkdtemp(prefix="aituzi_loadtest_")
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w") as f:
+        f.write('ZHIPU_API_KEY = "loadtest"\nGEMINI_API_KEY = "loadtest"\n')
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        rows, session_mb = run_capacity_curve(args)
+    finally:
+        os.chdir(original_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print_report(rows, args.slo_ms, session_mb)
+    if csv_path:
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=[c for c in rows[0] if c != "error_samples"],
+                                    extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"容量曲线已写入 {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
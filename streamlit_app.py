@@ -5,11 +5,22 @@ import PyPDF2
 from docx import Document
 from PIL import Image
 import io
-import json
+import os
+import threading
 import time
 import sqlite3
 import uuid
 import datetime
+from contextlib import contextmanager
+
+from analysis_result import (
+    RESULT_SCHEMA,
+    gemini_response_schema,
+    load_json_tolerant,
+    merge_missing_fields,
+    needs_source_content,
+    validate_analysis_result,
+)
 
 # -------------------------------------------------------------
 # 页面配置（必须放在最前面）
@@ -292,33 +303,155 @@ ANALYSIS_SYSTEM_PROMPT = """
 }
 """
 
+# 缺失字段补全 Prompt：只要求模型返回缺失/无效的字段，避免重新生成完整分析
+FIELD_RETRY_PROMPT = """
+你上一次返回的 JSON 缺少以下字段或字段取值无效：{fields}
+
+请只返回这些字段组成的 JSON 对象，保持原有的嵌套结构（如 {{"ai_detection": {{"score": 85}}}}），不要重复其他字段，不要包含 Markdown 代码块标记。
+"""
+
+# 补全 reason/sources/label 时不再重发原文或图片，用这句话占住原来的用户消息
+OMITTED_CONTENT_NOTE = "（原始待检测内容已省略，请基于你上一次的回答补全字段。）"
+
 # -------------------------------------------------------------
 # 3. 工具函数：文档解析
 # -------------------------------------------------------------
-def extract_text_from_pdf(file):
+PARSE_MEMORY_FACTOR = 4                            # 解析时对象树占用约为文件大小的倍数（估算）
+SESSION_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024    # 单个会话的解析内存预算
+GLOBAL_MEMORY_BUDGET_BYTES = 768 * 1024 * 1024     # 整个进程的解析内存预算
+MAX_ANALYSIS_CHARS = 100_000                       # 送入模型的最大字数，超出部分截断
+
+@st.cache_resource
+def get_memory_budget():
+    """跨会话共享的解析内存预算（每个进程一份）"""
+    return {"lock": threading.Lock(), "in_use": 0, "sessions": {}}
+
+@contextmanager
+def reserve_parse_memory(session_id, nbytes):
+    """在会话与全局预算内预留解析内存，预算不足时返回 False"""
+    budget = get_memory_budget()
+    with budget["lock"]:
+        session_used = budget["sessions"].get(session_id, 0)
+        granted = (session_used + nbytes <= SESSION_MEMORY_BUDGET_BYTES
+                   and budget["in_use"] + nbytes <= GLOBAL_MEMORY_BUDGET_BYTES)
+        if granted:
+            budget["sessions"][session_id] = session_used + nbytes
+            budget["in_use"] += nbytes
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    except Exception as e:
-        st.error(f"PDF 解析失败: {e}")
-        return None
+        yield granted
+    finally:
+        if granted:
+            with budget["lock"]:
+                budget["in_use"] -= nbytes
+                budget["sessions"][session_id] -= nbytes
+                if budget["sessions"][session_id] <= 0:
+                    del budget["sessions"][session_id]
+
+def extract_text_from_pdf(file):
+    """逐页产出 PDF 文本"""
+    pdf_reader = PyPDF2.PdfReader(file)
+    for page in pdf_reader.pages:
+        yield page.extract_text() or ""
 
 def extract_text_from_docx(file):
+    """逐段产出 Word 文本"""
+    doc = Document(file)
+    for para in doc.paragraphs:
+        yield para.text + "\n"
+
+def collect_text(chunks, limit=MAX_ANALYSIS_CHARS):
+    """把文本流写入同一个缓冲区，达到上限即停止读取，返回 (文本, 是否截断)"""
+    buffer = io.StringIO()
+    size = 0
+    for chunk in chunks:
+        if size + len(chunk) > limit:
+            buffer.write(chunk[:limit - size])
+            return buffer.getvalue(), True
+        buffer.write(chunk)
+        size += len(chunk)
+    return buffer.getvalue(), False
+
+def extract_text_from_upload(uploaded_file):
+    """在内存预算内解析上传的 PDF/Word 文档，返回 (文本, 是否截断)"""
+    if uploaded_file.name.endswith('.pdf'):
+        extractor, kind = extract_text_from_pdf, "PDF"
+    elif uploaded_file.name.endswith('.docx'):
+        extractor, kind = extract_text_from_docx, "Word"
+    else:
+        return None, False
+
+    estimate = uploaded_file.size * PARSE_MEMORY_FACTOR
+    with reserve_parse_memory(get_visitor_id(), estimate) as granted:
+        if not granted:
+            st.error("当前解析任务较多或文件过大，请稍后重试或上传更小的文件。")
+            return None, False
+        try:
+            uploaded_file.seek(0)
+            return collect_text(extractor(uploaded_file))
+        except Exception as e:
+            st.error(f"{kind} 解析失败: {e}")
+            return None, False
+
+def _current_rss_bytes():
+    """读取当前进程常驻内存（仅 Linux，其他平台返回 None）"""
     try:
-        doc = Document(file)
-        text = ""
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        return text
-    except Exception as e:
-        st.error(f"Word 解析失败: {e}")
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
         return None
 
+@contextmanager
+def track_process_rss(interval=0.05):
+    """后台线程定时采样进程 RSS，返回 {"start", "peak"}（字节），无法读取 RSS 时返回 None。
+    采样的是整个进程，并发会话会计入同一个峰值；退出时（包括重跑打断）一定停止采样"""
+    start = _current_rss_bytes()
+    if start is None:
+        yield None
+        return
+    usage = {"start": start, "peak": start}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            usage["peak"] = max(usage["peak"], _current_rss_bytes() or 0)
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield usage
+    finally:
+        stop.set()
+        thread.join()
+        usage["peak"] = max(usage["peak"], _current_rss_bytes() or 0)
+
+# -------------------------------------------------------------
+# 4. 工具函数：结构化输出解析与修复
+# -------------------------------------------------------------
+def parse_analysis_result(provider, raw_text, request_missing):
+    """解析模型输出：直接解析 -> 本地修复 -> 仅对缺失字段发起小请求补全"""
+    data, repaired = load_json_tolerant(raw_text)
+    if data is None:
+        record_parse_outcome(provider, "failed")
+        return {"error": "模型返回格式解析失败，请重试。"}
+
+    result, missing = validate_analysis_result(data)
+    outcome = "repaired" if repaired else "direct"
+    if missing:
+        outcome = "patched"
+        try:
+            patch, _ = load_json_tolerant(request_missing(missing))
+            result, missing = validate_analysis_result(merge_missing_fields(result, patch, missing))
+        except Exception as e:
+            print(f"缺失字段补全失败: {e}")
+
+    if missing:
+        record_parse_outcome(provider, "failed")
+        return {"error": f"模型返回结果缺少字段（{'、'.join(missing)}），请重试。"}
+    record_parse_outcome(provider, outcome)
+    return result
+
 # -------------------------------------------------------------
-# 4. 模型调用函数
+# 5. 模型调用函数
 # -------------------------------------------------------------
 def analyze_with_zhipu(api_key, content, is_image=False, image_data=None):
     """使用智谱 AI 进行分析"""
@@ -336,41 +469,63 @@ def analyze_with_zhipu(api_key, content, is_image=False, image_data=None):
             img_byte_arr = img_byte_arr.getvalue()
             base64_image = base64.b64encode(img_byte_arr).decode('utf-8')
             
-            response = client.chat.completions.create(
-                model="glm-4v", 
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": ANALYSIS_SYSTEM_PROMPT + "\n\n请分析这张图片中的文字内容："
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
+            model_name = "glm-4v"
+            request_kwargs = {}
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": ANALYSIS_SYSTEM_PROMPT + "\n\n请分析这张图片中的文字内容："
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64_image}"
                             }
-                        ]
-                    }
-                ]
-            )
+                        }
+                    ]
+                }
+            ]
         else:
-            # 文本模式 (GLM-4)
-            response = client.chat.completions.create(
-                model="glm-4",
-                messages=[
-                    {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
-                    {"role": "user", "content": content}
-                ],
-                temperature=0.1
-            )
-            
-        return json.loads(response.choices[0].message.content.replace('```json', '').replace('```', ''))
+            # 文本模式 (GLM-4)，开启 JSON 模式输出
+            model_name = "glm-4"
+            request_kwargs = {"temperature": 0.1, "response_format": {"type": "json_object"}}
+            messages = [
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ]
+
+        response = client.chat.completions.create(model=model_name, messages=messages, **request_kwargs)
+        raw_text = response.choices[0].message.content
+
+        def request_missing(missing):
+            """在原对话上追问，只让模型输出缺失字段。
+
+            只缺 label/reason/sources 时不重发原文或图片，改用 GLM-4 文本模式，输入只有上一轮回答；
+            缺分数字段时必须重新阅读原文/图片，输入开销接近完整重跑，节省的只是输出长度。
+            """
+            followup = [
+                {"role": "assistant", "content": raw_text},
+                {"role": "user", "content": FIELD_RETRY_PROMPT.format(fields="、".join(missing))}
+            ]
+            if needs_source_content(missing):
+                retry = client.chat.completions.create(model=model_name, messages=messages + followup, **request_kwargs)
+            else:
+                retry = client.chat.completions.create(
+                    model="glm-4",
+                    messages=[
+                        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                        {"role": "user", "content": OMITTED_CONTENT_NOTE}
+                    ] + followup,
+                    temperature=0.1,
+                    response_format={"type": "json_object"}
+                )
+            return retry.choices[0].message.content
+
+        return parse_analysis_result("zhipu", raw_text, request_missing)
     
-    except json.JSONDecodeError:
-        return {"error": "模型返回格式解析失败，请重试。"}
     except Exception as e:
         return {"error": f"智谱 API 调用失败: {str(e)}"}
 
@@ -384,24 +539,47 @@ def analyze_with_gemini(api_key, content, is_image=False, image_data=None):
         model = genai.GenerativeModel(
             model_name='gemini-2.5-flash',
             system_instruction=ANALYSIS_SYSTEM_PROMPT,
-            generation_config={"response_mime_type": "application/json"}
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": gemini_response_schema(RESULT_SCHEMA)
+            }
         )
         
         if is_image and image_data:
-            response = model.generate_content([
+            parts = [
                 "请分析这张图片中的文字内容，并按照系统提示的 JSON 格式输出。", 
                 image_data
-            ])
+            ]
         else:
-            response = model.generate_content(content)
-            
-        return json.loads(response.text)
+            parts = [content]
+        response = model.generate_content(parts)
+        raw_text = response.text
+
+        def request_missing(missing):
+            """在原对话上追问，只让模型输出缺失字段。
+
+            只缺 label/reason/sources 时用一句占位说明代替原文或图片；
+            缺分数字段时必须重发原文/图片，输入开销接近完整重跑，节省的只是输出长度。
+            补全请求不带 response_schema，否则模型会被要求重新输出全部字段。
+            """
+            source_parts = parts if needs_source_content(missing) else [OMITTED_CONTENT_NOTE]
+            retry = model.generate_content(
+                [
+                    {"role": "user", "parts": source_parts},
+                    {"role": "model", "parts": [raw_text]},
+                    {"role": "user", "parts": [FIELD_RETRY_PROMPT.format(fields="、".join(missing))]}
+                ],
+                generation_config={"response_mime_type": "application/json", "response_schema": None}
+            )
+            return retry.text
+
+        return parse_analysis_result("gemini", raw_text, request_missing)
         
     except Exception as e:
         return {"error": f"Gemini API 调用失败: {str(e)}"}
 
 # -------------------------------------------------------------
-# 5. 访问统计逻辑
+# 6. 访问统计逻辑
 # -------------------------------------------------------------
 DB_FILE = "aituzi_visit_stats.db"
 
@@ -418,6 +596,13 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS visitors 
                  (visitor_id TEXT PRIMARY KEY, 
                   first_visit_date TEXT)''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS parse_stats 
+                 (date TEXT, 
+                  provider TEXT, 
+                  outcome TEXT, 
+                  count INTEGER DEFAULT 0, 
+                  PRIMARY KEY (date, provider, outcome))''')
     
     # 2. 手动检查并添加缺失的列
     c.execute("PRAGMA table_info(visitors)")
@@ -433,6 +618,12 @@ def init_db():
     conn.commit()
     conn.close()
 
+@st.cache_resource
+def init_db_once():
+    """每个进程只建表/升级一次，避免每次 rerun 重复执行 DDL"""
+    init_db()
+    return True
+
 def get_visitor_id():
     """获取或生成访客ID"""
     if "visitor_id" not in st.session_state:
@@ -441,7 +632,7 @@ def get_visitor_id():
 
 def track_and_get_stats():
     """核心统计逻辑"""
-    init_db()
+    init_db_once()
     conn = sqlite3.connect(DB_FILE, check_same_thread=False)
     c = conn.cursor()
     
@@ -484,13 +675,33 @@ def track_and_get_stats():
     c.execute("SELECT pv_count FROM daily_traffic WHERE date=?", (today_str,))
     res_pv = c.fetchone()
     today_pv = res_pv[0] if res_pv else 0
+
+    # 4. 汇总历史解析结果 {outcome: count}
+    c.execute("SELECT outcome, SUM(count) FROM parse_stats GROUP BY outcome")
+    parse_stats = {outcome: total for outcome, total in c.fetchall()}
     
     conn.close()
     
-    return today_uv, total_uv, today_pv
+    return today_uv, total_uv, today_pv, parse_stats
+
+def record_parse_outcome(provider, outcome):
+    """记录一次模型输出解析结果：direct / repaired / patched / failed"""
+    try:
+        init_db_once()
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        c = conn.cursor()
+        today_str = datetime.datetime.utcnow().date().isoformat()
+        c.execute("INSERT OR IGNORE INTO parse_stats (date, provider, outcome, count) VALUES (?, ?, ?, 0)",
+                  (today_str, provider, outcome))
+        c.execute("UPDATE parse_stats SET count = count + 1 WHERE date=? AND provider=? AND outcome=?",
+                  (today_str, provider, outcome))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"解析统计写入失败: {e}")
 
 # -------------------------------------------------------------
-# 6. 初始化会话状态（修复核心）
+# 7. 初始化会话状态（修复核心）
 # -------------------------------------------------------------
 # 确保会话状态初始化
 if "sample_text" not in st.session_state:
@@ -502,7 +713,7 @@ for btn_label in SAMPLE_TEXTS.keys():
         st.session_state[f"btn_clicked_{btn_label}"] = False
 
 # -------------------------------------------------------------
-# 7. UI 布局与主逻辑（修复示例按钮）
+# 8. UI 布局与主逻辑（修复示例按钮）
 # -------------------------------------------------------------
 # 页面标题（更紧凑）
 st.markdown('<div class="main-header">🐰 AI兔子 内容与剽窃检测系统</div>', unsafe_allow_html=True)
@@ -524,6 +735,7 @@ content_to_analyze = ""
 image_to_analyze = None
 is_image_mode = False
 process_trigger = False
+parse_rss = None  # 文档解析阶段的进程内存采样
 
 
 with tab1:
@@ -584,14 +796,14 @@ with tab2:
         if st.button("开始分析", key="btn_doc", type="primary", use_container_width=True):
             if uploaded_file:
                 with st.spinner("解析文档中..."):
-                    if uploaded_file.name.endswith('.pdf'):
-                        content_to_analyze = extract_text_from_pdf(uploaded_file)
-                    elif uploaded_file.name.endswith('.docx'):
-                        content_to_analyze = extract_text_from_docx(uploaded_file)
+                    with track_process_rss() as parse_rss:
+                        content_to_analyze, truncated = extract_text_from_upload(uploaded_file)
                     
                     if content_to_analyze and len(content_to_analyze) > 10:
                         process_trigger = True
                         st.success(f"解析成功！{len(content_to_analyze)} 字")
+                        if truncated:
+                            st.info(f"文档较长，仅分析前 {MAX_ANALYSIS_CHARS} 字。")
                     else:
                         st.error("解析失败或内容为空")
             else:
@@ -630,12 +842,22 @@ if process_trigger:
         start_time = time.time()
         
         # 调用模型
-        if "Gemini" in model_provider:
-            result = analyze_with_gemini(current_api_key, content_to_analyze, is_image_mode, image_to_analyze)
-        else:
-            result = analyze_with_zhipu(current_api_key, content_to_analyze, is_image_mode, image_to_analyze)
+        with track_process_rss() as analysis_rss:
+            if "Gemini" in model_provider:
+                result = analyze_with_gemini(current_api_key, content_to_analyze, is_image_mode, image_to_analyze)
+            else:
+                result = analyze_with_zhipu(current_api_key, content_to_analyze, is_image_mode, image_to_analyze)
         
         end_time = time.time()
+        # 运维日志：进程级 RSS（并发会话会计入同一峰值），用于实例规格估算；读不到 RSS 时不报告
+        rss_report = ""
+        rss_samples = [usage for usage in (parse_rss, analysis_rss) if usage]
+        if rss_samples:
+            process_peak_mb = max(usage["peak"] for usage in rss_samples) / 1024 / 1024
+            process_delta_mb = process_peak_mb - rss_samples[0]["start"] / 1024 / 1024
+            rss_report = f" process_peak_rss={process_peak_mb:.1f}MB process_delta_rss={process_delta_mb:+.1f}MB"
+        print(f"[analysis] provider={model_provider} image={is_image_mode} chars={len(content_to_analyze or '')} "
+              f"elapsed={end_time - start_time:.2f}s{rss_report}")
 
     # 结果展示（紧凑化）
     if "error" in result:
@@ -707,9 +929,14 @@ if process_trigger:
 
 # --- 访问统计展示（紧凑化） ---
 try:
-    today_uv, total_uv, today_pv = track_and_get_stats()
+    today_uv, total_uv, today_pv, parse_stats = track_and_get_stats()
 except Exception as e:
-    today_uv, total_uv, today_pv = 0, 0, 0
+    today_uv, total_uv, today_pv, parse_stats = 0, 0, 0, {}
+
+# 本地修复与字段补全的次数即为避免的完整重跑次数（缺分数字段的补全仍会重发原文，只省输出）
+parse_total = sum(parse_stats.values())
+parse_saved = parse_stats.get("repaired", 0) + parse_stats.get("patched", 0)
+parse_rate = f"{parse_saved / parse_total:.0%}" if parse_total else "-"
 
 st.markdown(f"""
 <div class="metric-container">
@@ -719,5 +946,8 @@ st.markdown(f"""
     <div class="metric-box">
         <div class="metric-sub">历史总 UV: {total_uv}</div>
     </div>
+    <div class="metric-box">
+        <div class="metric-sub">JSON 修复: {parse_stats.get("repaired", 0)} | 字段补全: {parse_stats.get("patched", 0)} | 解析失败: {parse_stats.get("failed", 0)} | 避免重跑率: {parse_rate}</div>
+    </div>
 </div>
 """, unsafe_allow_html=True)
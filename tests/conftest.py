@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 让测试可以直接 import 仓库根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
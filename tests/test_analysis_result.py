@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from analysis_result import (
+    load_json_tolerant,
+    merge_missing_fields,
+    needs_source_content,
+    validate_analysis_result,
+)
+
+FULL = {
+    "ai_detection": {"label": "疑似AI", "score": 65, "reason": "句式工整"},
+    "plagiarism_detection": {"percentage": 20, "reason": "部分常见表述", "sources": "百科"},
+}
+FULL_TEXT = json.dumps(FULL, ensure_ascii=False)
+
+
+def test_plain_and_fenced_json():
+    assert load_json_tolerant(FULL_TEXT) == (FULL, False)
+    assert load_json_tolerant(f"```json\n{FULL_TEXT}\n```") == (FULL, False)
+
+
+def test_no_object_returns_none():
+    assert load_json_tolerant("抱歉，我无法完成该请求。") == (None, False)
+    assert load_json_tolerant("") == (None, False)
+
+
+def test_cut_inside_number_drops_partial_member():
+    # 85 被截成 8：不能当作 8 接受，只保留上一个逗号之前的成员
+    data, repaired = load_json_tolerant('{"ai_detection": {"label": "AI特征", "score": 8')
+    assert repaired
+    assert data == {"ai_detection": {"label": "AI特征"}}
+
+
+def test_cut_inside_string_drops_partial_member():
+    data, repaired = load_json_tolerant('{"ai_detection": {"score": 85, "reason": "用词过于')
+    assert repaired
+    assert data == {"ai_detection": {"score": 85}}
+
+
+def test_cut_before_first_comma_sends_all_fields_to_retry():
+    data, repaired = load_json_tolerant('{"ai_detection":{"score":8')
+    assert (data, repaired) == ({}, True)
+    _, missing = validate_analysis_result(data)
+    assert len(missing) == 6
+
+
+def test_concatenated_objects_keep_first():
+    data, repaired = load_json_tolerant(FULL_TEXT + '\n{"note": "second"}')
+    assert repaired
+    assert data == FULL
+
+
+def test_trailing_commas_removed_but_strings_untouched():
+    text = '{"ai_detection": {"reason": "a, }b", "score": 70,},}'
+    data, _ = load_json_tolerant(text)
+    assert data == {"ai_detection": {"reason": "a, }b", "score": 70}}
+
+
+@pytest.mark.parametrize("raw", ["NaN", "Infinity", "-Infinity"])
+def test_non_finite_numbers_are_invalid(raw):
+    data, _ = load_json_tolerant('{"ai_detection": {"score": %s}}' % raw)
+    result, missing = validate_analysis_result(data)
+    assert "score" not in result["ai_detection"]
+    assert "ai_detection.score" in missing
+
+
+@pytest.mark.parametrize("raw, expected", [("12%", 12), ("85", 85), (40.0, 40), (0, 0), (100, 100)])
+def test_integer_coercion(raw, expected):
+    result, _ = validate_analysis_result({"plagiarism_detection": {"percentage": raw}})
+    assert result["plagiarism_detection"]["percentage"] == expected
+
+
+@pytest.mark.parametrize("raw", [150, -1, 0.85, "12.5%", True, "无"])
+def test_out_of_range_or_fractional_integers_are_missing(raw):
+    result, missing = validate_analysis_result({"plagiarism_detection": {"percentage": raw}})
+    assert "percentage" not in result["plagiarism_detection"]
+    assert "plagiarism_detection.percentage" in missing
+
+
+def test_label_derived_from_score_and_enum_checked():
+    result, missing = validate_analysis_result({"ai_detection": {"score": 85, "reason": "x"}})
+    assert result["ai_detection"]["label"] == "AI特征"
+    assert not any(path.startswith("ai_detection") for path in missing)
+
+    result, missing = validate_analysis_result({"ai_detection": {"label": "机器", "reason": "x"}})
+    assert "ai_detection.label" in missing and "ai_detection.score" in missing
+
+
+def test_merge_only_fills_missing_fields():
+    base, missing = validate_analysis_result({
+        "ai_detection": {"score": 30, "reason": "自然"},
+        "plagiarism_detection": {"percentage": 10, "reason": "少量引用"},
+    })
+    assert missing == ["plagiarism_detection.sources"]
+    patch = {
+        "ai_detection": {"score": 99},
+        "plagiarism_detection": {"percentage": 90, "sources": "维基百科"},
+    }
+    result, missing = validate_analysis_result(merge_missing_fields(base, patch, missing))
+    assert missing == []
+    assert result["ai_detection"]["score"] == 30
+    assert result["plagiarism_detection"]["percentage"] == 10
+    assert result["plagiarism_detection"]["sources"] == "维基百科"
+
+
+def test_needs_source_content():
+    assert not needs_source_content(["plagiarism_detection.sources", "ai_detection.reason"])
+    assert needs_source_content(["ai_detection.score"])
+    assert needs_source_content(["plagiarism_detection.sources", "plagiarism_detection.percentage"])